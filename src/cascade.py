@@ -0,0 +1,310 @@
+"""Confidence-gated two-stage model cascade"""
+import argparse
+import json
+import threading
+import time
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+
+CLASS_NAMES = ['akiec', 'bcc', 'bkl', 'df', 'mel', 'nv', 'vasc']
+CASCADE_CONFIG = Path('models/cascade.json')
+
+class CascadeStats:
+    """Thread-safe per-stage hit and latency counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all counters"""
+        with self._lock:
+            self.images = 0
+            self.first_stage_hits = 0
+            self.escalated_low_confidence = 0
+            self.escalated_mel = 0
+            self.first_stage_seconds = 0.0
+            self.full_stage_seconds = 0.0
+            self.full_stage_images = 0
+
+    def record(self, n_images, n_low_confidence, n_mel, first_seconds, full_seconds):
+        """Record one cascade call"""
+        with self._lock:
+            self.images += n_images
+            self.first_stage_hits += n_images - n_low_confidence - n_mel
+            self.escalated_low_confidence += n_low_confidence
+            self.escalated_mel += n_mel
+            self.full_stage_images += n_low_confidence + n_mel
+            self.first_stage_seconds += first_seconds
+            self.full_stage_seconds += full_seconds
+
+    def summary(self):
+        """Return hit rates and mean per-image latency for each stage"""
+        with self._lock:
+            images = max(self.images, 1)
+            full_images = max(self.full_stage_images, 1)
+            return {
+                "images": self.images,
+                "first_stage_hit_rate": self.first_stage_hits / images,
+                "escalated_low_confidence": self.escalated_low_confidence,
+                "escalated_mel": self.escalated_mel,
+                "first_stage_ms_per_image": 1000 * self.first_stage_seconds / images,
+                "full_stage_ms_per_image": 1000 * self.full_stage_seconds / full_images,
+            }
+
+def calibrate_probabilities(probabilities, temperature):
+    """Apply temperature scaling to softmax outputs"""
+    logits = np.log(np.clip(probabilities, 1e-12, 1.0)) / temperature
+    logits -= logits.max(axis=-1, keepdims=True)
+    scaled = np.exp(logits)
+    return scaled / scaled.sum(axis=-1, keepdims=True)
+
+def fit_temperature(probabilities, labels, grid=np.linspace(0.5, 5.0, 46)):
+    """
+    Fit a softmax temperature by minimising negative log-likelihood
+
+    Args:
+        probabilities: Array of shape (n, n_classes)
+        labels: Integer class labels of shape (n,)
+        grid: Candidate temperatures
+
+    Returns:
+        Best temperature as a float
+    """
+    rows = np.arange(len(labels))
+    best_temperature, best_nll = 1.0, np.inf
+    for temperature in grid:
+        calibrated = calibrate_probabilities(probabilities, temperature)
+        nll = -np.mean(np.log(np.clip(calibrated[rows, labels], 1e-12, 1.0)))
+        if nll < best_nll:
+            best_temperature, best_nll = float(temperature), nll
+    return best_temperature
+
+class CascadeClassifier:
+    """
+    Route images through a cheap first stage and escalate the uncertain ones
+
+    An image is answered by the first stage only when its calibrated
+    confidence reaches the threshold and the predicted class is not in
+    escalate_classes (melanoma always goes to the full model).
+    """
+
+    def __init__(self, first_stage, full_model, threshold=0.9, temperature=1.0,
+                 first_stage_size=128, escalate_classes=('mel',)):
+        self.first_stage = first_stage
+        self.full_model = full_model
+        self.threshold = threshold
+        self.temperature = temperature
+        self.first_stage_size = first_stage_size
+        self.escalate_indices = [CLASS_NAMES.index(name) for name in escalate_classes]
+        self.stats = CascadeStats()
+
+    @classmethod
+    def from_config(cls, first_stage, full_model, config_path=CASCADE_CONFIG):
+        """Create a cascade using the calibration saved by `calibrate`"""
+        config = {}
+        if Path(config_path).exists():
+            with open(config_path) as f:
+                config = json.load(f)
+        return cls(first_stage, full_model, **config)
+
+    def with_models(self, first_stage, full_model):
+        """Return a cascade with the same calibration and stats over other models"""
+        cascade = CascadeClassifier(
+            first_stage, full_model, self.threshold, self.temperature, self.first_stage_size
+        )
+        cascade.escalate_indices = self.escalate_indices
+        cascade.stats = self.stats
+        return cascade
+
+    def first_stage_probabilities(self, img_array):
+        """Run the first stage on a preprocessed full-resolution batch"""
+        small = tf.image.resize(
+            img_array, (self.first_stage_size, self.first_stage_size), antialias=True
+        )
+        probabilities = self.first_stage.predict(small, verbose=0)
+        return calibrate_probabilities(probabilities, self.temperature)
+
+    def route(self, first_probabilities, threshold=None):
+        """
+        Decide which images must go to the full model
+
+        Returns:
+            Tuple of boolean masks (low_confidence, escalated_class)
+        """
+        threshold = self.threshold if threshold is None else threshold
+        predicted = np.argmax(first_probabilities, axis=1)
+        escalated_class = np.isin(predicted, self.escalate_indices)
+        low_confidence = (first_probabilities.max(axis=1) < threshold) & ~escalated_class
+        return low_confidence, escalated_class
+
+    def predict(self, img_array):
+        """
+        Predict a preprocessed (n, 224, 224, 3) batch through the cascade
+
+        Rows answered by the first stage hold temperature-calibrated
+        probabilities; escalated rows hold the full model's raw softmax.
+
+        Returns:
+            Tuple of (probabilities, stages) where stages[i] is 1 or 2
+        """
+        start = time.perf_counter()
+        probabilities = self.first_stage_probabilities(img_array)
+        first_seconds = time.perf_counter() - start
+
+        low_confidence, escalated_class = self.route(probabilities)
+        escalate = low_confidence | escalated_class
+        stages = np.where(escalate, 2, 1)
+
+        full_seconds = 0.0
+        if escalate.any():
+            start = time.perf_counter()
+            probabilities[escalate] = self.full_model.predict(img_array[escalate], verbose=0)
+            full_seconds = time.perf_counter() - start
+
+        self.stats.record(
+            len(img_array), int(low_confidence.sum()), int(escalated_class.sum()),
+            first_seconds, full_seconds
+        )
+        return probabilities, stages
+
+def load_labeled_directory(data_dir):
+    """
+    Load a class-per-folder directory (e.g. sample_images/) as arrays
+
+    Returns:
+        Tuple of (images, labels)
+    """
+    from src.similarity import load_image_array
+
+    images, labels = [], []
+    for class_dir in sorted(Path(data_dir).iterdir()):
+        if not class_dir.is_dir() or class_dir.name not in CLASS_NAMES:
+            continue
+        for path in sorted(class_dir.glob('*')):
+            if path.suffix.lower() in ('.jpg', '.jpeg', '.png'):
+                images.append(load_image_array(path))
+                labels.append(CLASS_NAMES.index(class_dir.name))
+
+    if not images:
+        raise ValueError(f"No labelled images found in {data_dir}")
+    return np.stack(images), np.array(labels)
+
+def _timed_predict(predict_fn, images, batch_size=32):
+    """
+    Run predict_fn over images in batches, returning (outputs, seconds per image)
+
+    One untimed warm-up batch runs first so model building and graph tracing
+    are not counted as steady-state inference cost.
+    """
+    predict_fn(images[:batch_size])
+
+    outputs = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        outputs.append(predict_fn(images[i:i + batch_size]))
+    seconds = time.perf_counter() - start
+    return np.concatenate(outputs), seconds / len(images)
+
+def evaluate(cascade, data_dir, thresholds):
+    """
+    Measure cost against accuracy of the cascade over a labelled directory
+
+    Both stages are run once over every image; each threshold is then
+    simulated from the cached outputs.
+
+    Args:
+        cascade: CascadeClassifier
+        data_dir: Class-per-folder directory of labelled images
+        thresholds: Confidence thresholds to evaluate
+
+    Returns:
+        List of result dictionaries, one per threshold
+    """
+    images, labels = load_labeled_directory(data_dir)
+    first, first_cost = _timed_predict(cascade.first_stage_probabilities, images)
+    full, full_cost = _timed_predict(
+        lambda batch: cascade.full_model.predict(batch, verbose=0), images
+    )
+
+    mel = CLASS_NAMES.index('mel')
+    full_predicted = np.argmax(full, axis=1)
+    results = []
+    for threshold in thresholds:
+        low_confidence, escalated_class = cascade.route(first, threshold)
+        escalate = low_confidence | escalated_class
+        predicted = np.where(escalate, full_predicted, np.argmax(first, axis=1))
+        mel_mask = labels == mel
+        results.append({
+            "threshold": threshold,
+            "escalation_rate": float(escalate.mean()),
+            "cascade_accuracy": float((predicted == labels).mean()),
+            "full_accuracy": float((full_predicted == labels).mean()),
+            "cascade_mel_recall": float((predicted[mel_mask] == mel).mean()) if mel_mask.any() else None,
+            "relative_cost": float((first_cost + escalate.mean() * full_cost) / full_cost),
+        })
+    return results
+
+def calibrate(cascade, data_dir, threshold, config_path=CASCADE_CONFIG):
+    """
+    Fit the first-stage temperature on a labelled directory and save the config
+
+    The directory should be a class-balanced hold-out set: classes in
+    escalate_classes never use the gate, so they do not count towards the
+    two classes required to fit a meaningful temperature.
+    """
+    images, labels = load_labeled_directory(data_dir)
+    gated_classes = set(labels.tolist()) - set(cascade.escalate_indices)
+    if len(gated_classes) < 2:
+        raise ValueError(
+            f"Calibration needs images from at least 2 gated classes, {data_dir} has "
+            f"{sorted(CLASS_NAMES[i] for i in gated_classes)}"
+        )
+
+    cascade.temperature = 1.0
+    raw, _ = _timed_predict(cascade.first_stage_probabilities, images)
+    cascade.temperature = fit_temperature(raw, labels)
+    cascade.threshold = threshold
+
+    config = {
+        "threshold": threshold,
+        "temperature": cascade.temperature,
+        "first_stage_size": cascade.first_stage_size,
+    }
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    print(f"✅ Temperature {cascade.temperature:.2f} saved to {config_path}")
+    return config
+
+if __name__ == "__main__":
+    from utils.load_model import load_face_model, build_low_resolution_model
+
+    parser = argparse.ArgumentParser(description="Calibrate and evaluate the model cascade")
+    parser.add_argument('command', choices=['calibrate', 'evaluate'])
+    parser.add_argument('data_dir', help="Class-per-folder directory of labelled images")
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help="Gate saved by calibrate")
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.8, 0.9, 0.95],
+                        help="Gates compared by evaluate")
+    parser.add_argument('--first-stage-size', type=int, default=None)
+    args = parser.parse_args()
+
+    full_model = load_face_model()
+    cascade = CascadeClassifier.from_config(None, full_model)
+    if args.first_stage_size:
+        cascade.first_stage_size = args.first_stage_size
+    cascade.first_stage = build_low_resolution_model(full_model, cascade.first_stage_size)
+
+    if args.command == 'calibrate':
+        calibrate(cascade, args.data_dir, args.threshold)
+    else:
+        print(f"{'threshold':>10} {'escalated':>10} {'accuracy':>10} {'full acc':>10} "
+              f"{'mel recall':>11} {'cost':>6}")
+        for row in evaluate(cascade, args.data_dir, args.thresholds):
+            mel_recall = row['cascade_mel_recall']
+            mel_text = f"{mel_recall:.2%}" if mel_recall is not None else "n/a"
+            print(f"{row['threshold']:>10.2f} {row['escalation_rate']:>10.2%} "
+                  f"{row['cascade_accuracy']:>10.2%} {row['full_accuracy']:>10.2%} "
+                  f"{mel_text:>11} {row['relative_cost']:>6.2f}")
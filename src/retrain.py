@@ -8,7 +8,12 @@ import streamlit as st
 import tensorflow.keras as keras  # pylint: disable=import-error,no-name-in-module
 from tensorflow.keras.preprocessing.image import ImageDataGenerator # pylint: disable=import-error,no-name-in-module
 from tensorflow.keras.applications.efficientnet import preprocess_input # pylint: disable=import-error,no-name-in-module
-from utils.load_model import recreate_model_architecture
+from utils.load_model import (
+    recreate_model_architecture,
+    save_head_checkpoint,
+    RETRAINED_MODELS,
+    HEAD_CHECKPOINT_SUFFIX
+)
 
 def save_uploaded_files(uploaded_files, selected_class, save_dir='data/retrain'):
     """
@@ -139,16 +144,18 @@ def retrain_model(data_dir, base_model_path='models/Skin_Cancer_Model_v1.keras',
         verbose=1
     )
 
-    # Save new model
+    # Save only the head; the frozen backbone is shared with the base model
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    new_model_path = f'models/retrained_models/skin_cancer_model_{timestamp}.keras'
-    model.save(new_model_path)
+    RETRAINED_MODELS.mkdir(parents=True, exist_ok=True)
+    new_model_path = str(RETRAINED_MODELS / f'skin_cancer_model_{timestamp}{HEAD_CHECKPOINT_SUFFIX}')
+    backbone_sha256 = save_head_checkpoint(model, new_model_path)
 
     # Save metadata
     metadata = {
         'timestamp': timestamp,
         'base_model': base_model_path,
         'new_model': new_model_path,
+        'backbone_sha256': backbone_sha256,
         'epochs': epochs,
         'training_accuracy': float(history.history['accuracy'][-1]),
         'validation_accuracy': float(history.history['val_accuracy'][-1]),
@@ -0,0 +1,285 @@
+"""Similar-case retrieval over pooled EfficientNet embeddings"""
+import argparse
+import itertools
+import json
+import math
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from PIL import Image
+import tensorflow.keras as keras  # pylint: disable=import-error,no-name-in-module
+
+INDEX_DIR = Path('models/similarity_index')
+METADATA_CSV = Path('notebook/HAM10000 Dermatologist Metadata.csv')
+RECORD_FIELDS = ['image_id', 'lesion_id', 'dx', 'age', 'sex', 'localization']
+SEARCH_CHUNK_ROWS = 65536
+
+class SimilarityIndex:
+    """
+    Append-only embedding index stored as a memory-mapped matrix
+
+    Layout of the index directory:
+        index.json      - dim, dtype and row count
+        embeddings.bin  - L2-normalised rows (float16, or int8 when quantised)
+        scales.bin      - float32 per-row scale (int8 only)
+        records.jsonl   - one metadata record per row
+    """
+
+    def __init__(self, index_dir, dim, dtype='float16'):
+        if dtype not in ('float16', 'int8'):
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+
+        self.index_dir = Path(index_dir)
+        self.dim = dim
+        self.dtype = dtype
+        self.records = []
+        self.mtime_ns = None
+        self._embeddings = None
+        self._scales = None
+
+    @classmethod
+    def open(cls, index_dir=INDEX_DIR):
+        """Open an existing index read-only via memory mapping"""
+        index_dir = Path(index_dir)
+        mtime_ns = (index_dir / 'index.json').stat().st_mtime_ns
+        with open(index_dir / 'index.json') as f:
+            info = json.load(f)
+
+        index = cls(index_dir, info['dim'], info['dtype'])
+        index.mtime_ns = mtime_ns
+
+        # Rows past the recorded count belong to an interrupted (or in-progress) append
+        with open(index_dir / 'records.jsonl') as f:
+            index.records = [json.loads(line) for line in itertools.islice(f, info['count'])]
+
+        index._map(info['count'])
+        return index
+
+    @classmethod
+    def open_or_create(cls, index_dir=INDEX_DIR, dim=1280, dtype='float16'):
+        """Open the index for writing if it exists, otherwise start an empty one"""
+        if (Path(index_dir) / 'index.json').exists():
+            index = cls.open(index_dir)
+        else:
+            index = cls(index_dir, dim, dtype)
+        index._discard_partial_append()
+        return index
+
+    def __len__(self):
+        return len(self.records)
+
+    def is_stale(self):
+        """Whether index.json has been rewritten since this index was opened"""
+        try:
+            return (self.index_dir / 'index.json').stat().st_mtime_ns != self.mtime_ns
+        except FileNotFoundError:
+            return False
+
+    @property
+    def image_ids(self):
+        """Set of image ids already present in the index"""
+        return {record['image_id'] for record in self.records}
+
+    def _discard_partial_append(self):
+        """Truncate data files to the recorded row count so appends start at the right offset"""
+        count = len(self.records)
+        _truncate(self.index_dir / 'embeddings.bin', count * self.dim * np.dtype(self.dtype).itemsize)
+        _truncate(self.index_dir / 'scales.bin', count * np.dtype(np.float32).itemsize)
+
+        records_path = self.index_dir / 'records.jsonl'
+        if records_path.exists():
+            with open(records_path, 'rb') as f:
+                size = sum(len(line) for line in itertools.islice(f, count))
+            _truncate(records_path, size)
+
+    def _map(self, count):
+        """(Re)create memory maps over the first `count` rows"""
+        if count == 0:
+            self._embeddings = None
+            self._scales = None
+            return
+
+        self._embeddings = np.memmap(
+            self.index_dir / 'embeddings.bin', dtype=self.dtype, mode='r', shape=(count, self.dim)
+        )
+        if self.dtype == 'int8':
+            self._scales = np.memmap(
+                self.index_dir / 'scales.bin', dtype=np.float32, mode='r', shape=(count,)
+            )
+
+    def add(self, embeddings, records):
+        """
+        Append embeddings and their metadata records to the index
+
+        Args:
+            embeddings: Array of shape (n, dim)
+            records: List of n metadata dictionaries
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of shape (n, {self.dim}), got {embeddings.shape}")
+        if len(embeddings) != len(records):
+            raise ValueError("Number of embeddings and records must match")
+        if len(embeddings) == 0:
+            return
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._discard_partial_append()
+        embeddings = _l2_normalize(embeddings)
+
+        if self.dtype == 'int8':
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            rows = np.round(embeddings / scales[:, None]).astype(np.int8)
+            with open(self.index_dir / 'scales.bin', 'ab') as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            rows = embeddings.astype(np.float16)
+
+        with open(self.index_dir / 'embeddings.bin', 'ab') as f:
+            f.write(rows.tobytes())
+
+        with open(self.index_dir / 'records.jsonl', 'a') as f:
+            for record in records:
+                json.dump(record, f)
+                f.write('\n')
+
+        self.records.extend(records)
+
+        # Row count is committed last (atomically) so readers never see a partial append;
+        # leftover bytes from a crash are truncated before the next append
+        tmp_path = self.index_dir / 'index.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'dtype': self.dtype, 'count': len(self.records)}, f)
+        os.replace(tmp_path, self.index_dir / 'index.json')
+        self.mtime_ns = (self.index_dir / 'index.json').stat().st_mtime_ns
+
+        self._map(len(self.records))
+
+    def search(self, query, k=5):
+        """
+        Find the k most similar indexed cases by cosine similarity
+
+        Args:
+            query: Embedding of shape (dim,)
+            k: Number of neighbours to return
+
+        Returns:
+            List of metadata records with an added 'similarity' score
+        """
+        if self._embeddings is None or k <= 0:
+            return []
+
+        query = _l2_normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        count = len(self.records)
+        scores = np.empty(count, dtype=np.float32)
+
+        # Score the memmap in chunks so only a slice is ever upcast to float32
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            end = min(start + SEARCH_CHUNK_ROWS, count)
+            scores[start:end] = self._embeddings[start:end].astype(np.float32) @ query
+            if self._scales is not None:
+                scores[start:end] *= self._scales[start:end]
+
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {**self.records[i], 'similarity': float(scores[i])}
+            for i in top
+        ]
+
+def _truncate(path, size):
+    """Shrink a file to size bytes if it is longer"""
+    if path.exists() and path.stat().st_size > size:
+        os.truncate(path, size)
+
+def _l2_normalize(embeddings):
+    """Normalise rows to unit length so dot product equals cosine similarity"""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def load_image_array(path, img_size=224):
+    """Load an image from disk and preprocess it for EfficientNet"""
+    image = Image.open(path)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    img_array = np.array(image.resize((img_size, img_size)))
+    return keras.applications.efficientnet.preprocess_input(img_array)
+
+def _clean_record(row):
+    """Convert a metadata row into a JSON-serialisable record"""
+    record = {}
+    for field in RECORD_FIELDS:
+        value = row.get(field)
+        if isinstance(value, float) and math.isnan(value):
+            value = None
+        record[field] = value
+    return record
+
+def update_index(embedding_model, image_dir, metadata_csv=METADATA_CSV,
+                 index_dir=INDEX_DIR, dtype='float16', batch_size=32):
+    """
+    Embed labelled images that are not yet in the index and append them
+
+    Images are matched to metadata rows by file stem (e.g. ISIC_0027419.jpg),
+    searching image_dir recursively. Re-running with new images only embeds
+    the new ones.
+
+    Args:
+        embedding_model: Model returned by build_embedding_model
+        image_dir: Directory containing the labelled images
+        metadata_csv: CSV with image_id, dx, age, localization columns
+        index_dir: Directory holding the index
+        dtype: Storage dtype for a new index ('float16' or 'int8')
+        batch_size: Images per forward pass
+
+    Returns:
+        Number of images added
+    """
+    metadata = pd.read_csv(metadata_csv).set_index('image_id', drop=False)
+    index = SimilarityIndex.open_or_create(
+        index_dir, dim=embedding_model.outputs[0].shape[-1], dtype=dtype
+    )
+    indexed = index.image_ids
+
+    image_paths = {
+        path.stem: path
+        for path in Path(image_dir).rglob('*')
+        if path.suffix.lower() in ('.jpg', '.jpeg', '.png')
+    }
+    pending = [
+        image_id for image_id in metadata.index
+        if image_id in image_paths and image_id not in indexed
+    ]
+
+    print(f"Indexing {len(pending)} new images ({len(index)} already indexed)...")
+
+    for start in range(0, len(pending), batch_size):
+        batch_ids = pending[start:start + batch_size]
+        batch = np.stack([load_image_array(image_paths[image_id]) for image_id in batch_ids])
+        embeddings, _ = embedding_model.predict(batch, verbose=0)
+        records = [_clean_record(metadata.loc[image_id].to_dict()) for image_id in batch_ids]
+        index.add(embeddings, records)
+
+    print(f"✅ Index now holds {len(index)} images")
+    return len(pending)
+
+if __name__ == "__main__":
+    from utils.load_model import load_face_model, build_embedding_model
+
+    parser = argparse.ArgumentParser(description="Build or extend the similar-case index")
+    parser.add_argument('image_dir', help="Directory containing HAM10000 images")
+    parser.add_argument('--metadata', default=str(METADATA_CSV))
+    parser.add_argument('--index-dir', default=str(INDEX_DIR))
+    parser.add_argument('--dtype', choices=['float16', 'int8'], default='float16')
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    embedder = build_embedding_model(load_face_model())
+    update_index(embedder, args.image_dir, args.metadata, args.index_dir,
+                 args.dtype, args.batch_size)
@@ -0,0 +1,200 @@
+"""Admission control, deadlines and load shedding for the inference queue"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+import numpy as np
+from fastapi import HTTPException
+
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+MAX_CONCURRENCY = int(os.environ.get('API_MAX_CONCURRENCY', '1'))
+MAX_QUEUE = {
+    'interactive': int(os.environ.get('API_MAX_QUEUE_INTERACTIVE', '32')),
+    'bulk': int(os.environ.get('API_MAX_QUEUE_BULK', '16')),
+}
+DEFAULT_DEADLINE_MS = int(os.environ.get('API_DEFAULT_DEADLINE_MS', '2000'))
+QUEUE_TIME_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+QUEUE_TIME_SAMPLES = 2048
+# Per-image samples are clamped to this multiple of the current average so a
+# one-off slow call (graph tracing, CPU contention) cannot swamp the estimate
+SERVICE_TIME_MAX_GROWTH = 3.0
+
+class AdmissionController:
+    """
+    Bounded priority queue in front of a fixed number of inference slots
+
+    A request that finds a free slot and an empty queue is always admitted.
+    Otherwise it is shed with 503 + Retry-After when its priority class queue
+    is full, when the estimated wait for the work queued ahead of it already
+    passes its deadline, or when its deadline passes while it is queued.
+    Interactive requests are always dequeued before bulk ones.
+
+    Work is measured in images: each request carries a cost (its batch
+    size) and service_time is an average per image, so batched requests do
+    not inflate the estimates used for single-image ones.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_queue=None,
+                 default_deadline_ms=DEFAULT_DEADLINE_MS, initial_service_time=0.2):
+        self.max_concurrency = max_concurrency
+        self.max_queue = dict(MAX_QUEUE if max_queue is None else max_queue)
+        self.default_deadline_ms = default_deadline_ms
+        self.service_time = initial_service_time
+        self._active = 0
+        self._active_cost = 0
+        self._waiters = []
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        self._queued_cost = {priority: 0 for priority in PRIORITIES}
+        self._sequence = itertools.count()
+        self.served = {priority: 0 for priority in PRIORITIES}
+        self.shed = {
+            priority: {'queue_full': 0, 'deadline': 0}
+            for priority in PRIORITIES
+        }
+        self.queue_times = {
+            priority: deque(maxlen=QUEUE_TIME_SAMPLES)
+            for priority in PRIORITIES
+        }
+
+    def _work_ahead(self, priority):
+        """Images that would be processed before a new request of this priority starts"""
+        rank = PRIORITIES[priority]
+        queued = sum(
+            cost for name, cost in self._queued_cost.items()
+            if PRIORITIES[name] <= rank
+        )
+        return self._active_cost + queued
+
+    def _estimated_wait(self, priority):
+        """Estimated seconds until a new request of this priority starts"""
+        rank = PRIORITIES[priority]
+        queued_ahead = any(
+            count for name, count in self._queued.items()
+            if PRIORITIES[name] <= rank
+        )
+        if self._active < self.max_concurrency and not queued_ahead:
+            return 0.0
+        return self._work_ahead(priority) / self.max_concurrency * self.service_time
+
+    def _shed(self, priority, reason):
+        """Count and raise a fast 503 with a Retry-After hint"""
+        self.shed[priority][reason] += 1
+        retry_after = max(1, math.ceil(self._estimated_wait(priority)))
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server overloaded ({reason}), request shed",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    def _dequeue(self, priority, cost):
+        """Remove a waiter from the queue counters"""
+        self._queued[priority] -= 1
+        self._queued_cost[priority] -= cost
+
+    def _release(self, cost):
+        """Hand the slot to the highest-priority live waiter, or free it"""
+        self._active_cost -= cost
+        while self._waiters:
+            _, _, priority, waiter_cost, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._dequeue(priority, waiter_cost)
+                self._active_cost += waiter_cost
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority='interactive', deadline_ms=None, cost=1):
+        """
+        Wait for an inference slot or shed the request
+
+        Args:
+            priority: 'interactive' or 'bulk'
+            deadline_ms: Time budget from now; defaults to the server default
+            cost: Number of images the request will run through the model
+
+        Yields:
+            Seconds remaining until the deadline once the slot is granted
+        """
+        if priority not in PRIORITIES:
+            raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
+
+        arrival = time.monotonic()
+        deadline = arrival + (deadline_ms or self.default_deadline_ms) / 1000
+
+        if self._active < self.max_concurrency and not any(self._queued.values()):
+            self._active += 1
+            self._active_cost += cost
+        else:
+            if self._queued[priority] >= self.max_queue[priority]:
+                self._shed(priority, 'queue_full')
+            if arrival + self._estimated_wait(priority) > deadline:
+                self._shed(priority, 'deadline')
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self._waiters,
+                (PRIORITIES[priority], next(self._sequence), priority, cost, future)
+            )
+            self._queued[priority] += 1
+            self._queued_cost[priority] += cost
+            try:
+                # Give up once the deadline passes before a slot frees up
+                timeout = max(deadline - time.monotonic(), 0)
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                if future.done():
+                    self._release(cost)
+                else:
+                    future.cancel()
+                    self._dequeue(priority, cost)
+                self._shed(priority, 'deadline')
+            except asyncio.CancelledError:
+                if future.done():
+                    self._release(cost)
+                else:
+                    future.cancel()
+                    self._dequeue(priority, cost)
+                raise
+
+        started = time.monotonic()
+        self.queue_times[priority].append(1000 * (started - arrival))
+        try:
+            yield deadline - started
+        finally:
+            # Exponentially weighted per-image service time drives wait estimates
+            elapsed = time.monotonic() - started
+            sample = min(elapsed / cost, SERVICE_TIME_MAX_GROWTH * self.service_time)
+            self.service_time = 0.8 * self.service_time + 0.2 * sample
+            self.served[priority] += 1
+            self._release(cost)
+
+    def summary(self):
+        """Return queue depth, shed counts and queue-time distribution per priority"""
+        queue_time = {}
+        for priority, samples in self.queue_times.items():
+            values = np.array(samples) if samples else np.zeros(1)
+            counts, _ = np.histogram(values, bins=[0] + QUEUE_TIME_BUCKETS_MS + [np.inf])
+            queue_time[priority] = {
+                "p50_ms": float(np.percentile(values, 50)),
+                "p90_ms": float(np.percentile(values, 90)),
+                "p99_ms": float(np.percentile(values, 99)),
+                "histogram": {
+                    f"le_{bound}ms": int(count)
+                    for bound, count in zip(QUEUE_TIME_BUCKETS_MS + ['inf'], np.cumsum(counts))
+                } if samples else {},
+            }
+
+        return {
+            "active": self._active,
+            "queued": dict(self._queued),
+            "queued_images": dict(self._queued_cost),
+            "service_time_ms_per_image": 1000 * self.service_time,
+            "served": dict(self.served),
+            "shed": {priority: dict(reasons) for priority, reasons in self.shed.items()},
+            "queue_time": queue_time,
+        }
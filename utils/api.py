@@ -1,25 +1,103 @@
 """FastAPI wrapper for model serving and load testing"""
-import io
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+import os
+import secrets
+import zipfile
+from pathlib import Path
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse # import-error
-from PIL import Image
 import numpy as np
 import tensorflow.keras as keras # disable=import-error
-from utils.load_model import load_face_model
+from utils.load_model import (
+    load_face_model,
+    build_embedding_model,
+    build_low_resolution_model,
+    clone_with_head_checkpoint,
+    RETRAINED_MODELS,
+    HEAD_CHECKPOINT_SUFFIX
+)
+from src.similarity import SimilarityIndex, INDEX_DIR
+from src.cascade import CascadeClassifier
+from utils.admission import AdmissionController
+from utils.tensors import check_tensor_request, tensor_from_body
+from utils.uploads import (
+    UploadLimitMiddleware,
+    open_upload_image,
+    estimate_request_memory,
+    upload_metrics
+)
 
 app = FastAPI(title="Skin Cancer Classifier API")
+app.add_middleware(UploadLimitMiddleware)
 
 # Load model at startup
 model = None
+embedding_model = None
+similarity_index = None
+cascade = None
+base_models = None
+active_version = None
+version_lock = asyncio.Lock()
+admission = AdmissionController()
+CASCADE_MODE = os.environ.get('CASCADE_MODE', 'false').lower() == 'true'
+ADMIN_TOKEN = os.environ.get('API_ADMIN_TOKEN') or None
+BASE_VERSION = 'base'
 CLASS_NAMES = ['akiec', 'bcc', 'bkl', 'df', 'mel', 'nv', 'vasc']
 
 @app.on_event("startup")
 async def load_model():
     """Load model when API starts"""
-    global model
+    global model, embedding_model, cascade, base_models, active_version
     model = load_face_model()
     print("✅ Model loaded successfully")
 
+    if model is not None:
+        embedding_model = build_embedding_model(model)
+
+    if model is not None and CASCADE_MODE:
+        cascade = CascadeClassifier.from_config(None, model)
+        cascade.first_stage = build_low_resolution_model(model, cascade.first_stage_size)
+        print(f"✅ Cascade enabled (threshold {cascade.threshold}, "
+              f"{cascade.first_stage_size}px first stage)")
+
+    base_models = (model, embedding_model, cascade)
+    active_version = BASE_VERSION
+
+    if current_similarity_index() is not None:
+        print(f"✅ Similarity index loaded ({len(similarity_index)} cases)")
+
+def current_similarity_index():
+    """Return the similarity index, reopening it when it has grown on disk"""
+    global similarity_index
+    if similarity_index is None or similarity_index.is_stale():
+        if (INDEX_DIR / 'index.json').exists():
+            similarity_index = SimilarityIndex.open(INDEX_DIR)
+    return similarity_index
+
+def preprocess_image(image):
+    """Decode a validated upload into a preprocessed (1, 224, 224, 3) batch"""
+    # Convert to RGB if needed
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    # Preprocess for EfficientNet
+    img_array = np.array(image.resize((224, 224)))
+    img_array = keras.applications.efficientnet.preprocess_input(img_array)
+    return np.expand_dims(img_array, axis=0)
+
+def format_prediction(probabilities):
+    """Build the prediction response body from a probability vector"""
+    return {
+        "predicted_class": CLASS_NAMES[np.argmax(probabilities)],
+        "confidence": float(np.max(probabilities)),
+        "all_predictions": {
+            CLASS_NAMES[i]: float(probabilities[i])
+            for i in range(len(CLASS_NAMES))
+        }
+    }
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -30,14 +108,49 @@ async def health():
     """Health check for load balancers"""
     return {
         "status": "healthy",
-        "model_loaded": model is not None
+        "model_loaded": model is not None,
+        "model_version": active_version
     }
 
+def classify_batch(img_array):
+    """Classify a preprocessed (n, 224, 224, 3) batch (blocking)"""
+    if cascade is not None:
+        predictions, stages = cascade.predict(img_array)
+        results = [format_prediction(p) for p in predictions]
+        for result, stage in zip(results, stages):
+            # Only first-stage confidences are temperature-calibrated
+            result["stage"] = int(stage)
+            result["confidence_calibrated"] = bool(stage == 1)
+        return results
+
+    predictions = model.predict(img_array, verbose=0)
+    return [format_prediction(p) for p in predictions]
+
+def run_prediction(image):
+    """Decode, preprocess and classify one image (blocking)"""
+    return classify_batch(preprocess_image(image))[0]
+
+def run_similar(image, index, k):
+    """Classify one image and look up its neighbours from the same forward pass (blocking)"""
+    img_array = preprocess_image(image)
+
+    embeddings, predictions = embedding_model.predict(img_array, verbose=0)
+    result = format_prediction(predictions[0])
+    result["similar_cases"] = index.search(embeddings[0], k=k)
+    return result
+
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(
+    file: UploadFile = File(...),
+    priority: str = Header('interactive', alias='X-Request-Priority'),
+    deadline_ms: Optional[int] = Header(None, alias='X-Request-Deadline-Ms')
+):
     """
     Predict skin cancer class from uploaded image
-    
+
+    Requests that cannot start inference before their deadline are shed
+    with 503 and a Retry-After header.
+
     Returns:
         JSON with predicted class, confidence, and all probabilities
     """
@@ -45,39 +158,168 @@ async def predict(file: UploadFile = File(...)):
         raise HTTPException(status_code=503, detail="Model not loaded")
 
     try:
-        # Read and preprocess image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-
-        # Preprocess for EfficientNet
-        img_array = np.array(image.resize((224, 224)))
-        img_array = keras.applications.efficientnet.preprocess_input(img_array)
-        img_array = np.expand_dims(img_array, axis=0)
-
-        # Predict
-        predictions = model.predict(img_array, verbose=0)
-        predicted_class = CLASS_NAMES[np.argmax(predictions[0])]
-        confidence = float(np.max(predictions[0]))
-
-        # All probabilities
-        all_predictions = {
-            CLASS_NAMES[i]: float(predictions[0][i])
-            for i in range(len(CLASS_NAMES))
-        }
+        image = open_upload_image(file)
+        async with admission.slot(priority, deadline_ms):
+            with upload_metrics.track(estimate_request_memory(file, image)):
+                return await run_in_threadpool(run_prediction, image)
 
-        return {
-            "predicted_class": predicted_class,
-            "confidence": confidence,
-            "all_predictions": all_predictions
-        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
+
+@app.post("/predict/tensor")
+async def predict_tensor(
+    request: Request,
+    shape: Optional[str] = Header(None, alias='X-Tensor-Shape'),
+    priority: str = Header('interactive', alias='X-Request-Priority'),
+    deadline_ms: Optional[int] = Header(None, alias='X-Request-Deadline-Ms')
+):
+    """
+    Predict from pre-sized uint8 RGB tensors sent by edge clients
+
+    The body is either raw bytes with an X-Tensor-Shape header
+    (224,224,3 or n,224,224,3) or a .npy file. Raw payloads are checked
+    against Content-Length before the body is read; the payload is then
+    wrapped without copying or decoding and fed to the batched inference path.
+
+    Returns:
+        JSON with one prediction per image
+    """
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
 
+    payload_format = check_tensor_request(
+        request.headers.get('content-type'), request.headers.get('content-length'), shape
+    )
+    body = await request.body()
+    batch = tensor_from_body(body, payload_format, shape)
+
+    try:
+        async with admission.slot(priority, deadline_ms, cost=len(batch)):
+            with upload_metrics.track(len(body)):
+                img_array = keras.applications.efficientnet.preprocess_input(batch)
+                return {"predictions": await run_in_threadpool(classify_batch, img_array)}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error processing tensor: {str(e)}")
+
+@app.post("/similar")
+async def similar(
+    file: UploadFile = File(...),
+    k: int = Query(5, ge=1, le=50),
+    priority: str = Header('interactive', alias='X-Request-Priority'),
+    deadline_ms: Optional[int] = Header(None, alias='X-Request-Deadline-Ms')
+):
+    """
+    Predict skin cancer class and retrieve the most similar diagnosed cases
+
+    The embedding used for retrieval comes from the same forward pass as the
+    prediction, so this costs the same as /predict plus an index lookup.
+
+    Returns:
+        JSON with the prediction fields plus similar_cases (dx, age, localization)
+    """
+    if embedding_model is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    index = current_similarity_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Similarity index not built")
+
+    try:
+        image = open_upload_image(file)
+        async with admission.slot(priority, deadline_ms):
+            with upload_metrics.track(estimate_request_memory(file, image)):
+                return await run_in_threadpool(run_similar, image, index, k)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing image: {str(e)}")
 
+def build_version(checkpoint_path):
+    """Build (model, embedding_model, cascade) for a head checkpoint without touching the live models (blocking)"""
+    base_model, _, base_cascade = base_models
+    new_model = clone_with_head_checkpoint(base_model, checkpoint_path)
+
+    new_embedding_model = build_embedding_model(new_model)
+
+    # Warm up each new model so the first request after the switch does not pay for tracing
+    dummy = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    new_model.predict(dummy, verbose=0)
+    new_embedding_model.predict(dummy, verbose=0)
+
+    new_cascade = None
+    if base_cascade is not None:
+        size = base_cascade.first_stage_size
+        first_stage = build_low_resolution_model(
+            new_model, size, base_model=base_cascade.first_stage.layers[0]
+        )
+        first_stage.predict(np.zeros((1, size, size, 3), dtype=np.float32), verbose=0)
+        new_cascade = base_cascade.with_models(first_stage, new_model)
+
+    return new_model, new_embedding_model, new_cascade
+
+@app.post("/model/version")
+async def switch_model_version(
+    checkpoint: str = Query(...),
+    admin_token: Optional[str] = Header(None, alias='X-Admin-Token')
+):
+    """
+    Switch to a retrained head checkpoint from models/retrained_models,
+    or back to the base model with checkpoint=base
+
+    The new head is loaded into fresh layers that share the frozen backbone,
+    then the serving references are swapped at once, so in-flight requests
+    finish on the old version and never see a partially loaded head.
+    Requires X-Admin-Token matching API_ADMIN_TOKEN.
+    """
+    global model, embedding_model, cascade, active_version
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Model switching is disabled (API_ADMIN_TOKEN not set)")
+    if admin_token is None or not secrets.compare_digest(admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    if base_models is None or base_models[0] is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    async with version_lock:
+        if checkpoint == BASE_VERSION:
+            models = base_models
+            version = BASE_VERSION
+        else:
+            path = RETRAINED_MODELS / Path(checkpoint).name
+            if not path.name.endswith(HEAD_CHECKPOINT_SUFFIX):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Only head checkpoints can be activated; convert archives with utils.convert_checkpoints"
+                )
+            if not path.exists():
+                raise HTTPException(status_code=404, detail=f"Checkpoint not found: {path.name}")
+
+            try:
+                models = await run_in_threadpool(build_version, path)
+            except (KeyError, zipfile.BadZipFile, EOFError, OSError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid checkpoint {path.name}: {e}")
+            except ValueError as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            version = path.name
+
+        model, embedding_model, cascade = models
+        active_version = version
+
+    return {"model_version": active_version}
+
+@app.get("/metrics")
+async def metrics():
+    """Serving metrics"""
+    return {
+        "cascade": cascade.stats.summary() if cascade is not None else None,
+        "uploads": upload_metrics.summary(),
+        "admission": admission.summary()
+    }
+
 @app.get("/classes")
 async def get_classes():
     """Get list of available classes"""
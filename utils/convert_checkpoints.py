@@ -0,0 +1,66 @@
+"""Convert full retrained .keras archives into head-only checkpoints"""
+import argparse
+import json
+from pathlib import Path
+from utils.load_model import (
+    recreate_model_architecture,
+    save_head_checkpoint,
+    RETRAINED_MODELS,
+    HEAD_CHECKPOINT_SUFFIX
+)
+
+def update_log(log_path, archive_path, head_path):
+    """Point retraining log entries for archive_path at head_path"""
+    log_path = Path(log_path)
+    if not log_path.exists():
+        return
+
+    with open(log_path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+
+    for entry in entries:
+        if entry.get('new_model') == archive_path:
+            entry['new_model'] = head_path
+
+    tmp_path = log_path.with_name(log_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        for entry in entries:
+            json.dump(entry, f)
+            f.write('\n')
+    tmp_path.replace(log_path)
+
+def main():
+    """Convert every archive, updating the log before any archive is deleted"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models-dir', default=str(RETRAINED_MODELS))
+    parser.add_argument('--log', default='models/retraining_log.json')
+    parser.add_argument('--delete', action='store_true', help="Remove the .keras archives after converting")
+    args = parser.parse_args()
+
+    print("Recreating model architecture...")
+    model = recreate_model_architecture()
+
+    converted, failed = 0, 0
+    for archive in sorted(Path(args.models_dir).glob('*.keras')):
+        head_path = archive.with_name(archive.stem + HEAD_CHECKPOINT_SUFFIX)
+
+        print(f"Converting {archive.name}...")
+        try:
+            model.load_weights(str(archive))
+            save_head_checkpoint(model, str(head_path))
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"⚠️ Skipping {archive.name}: {e}")
+            failed += 1
+            continue
+
+        print(f"   {archive.stat().st_size / 1e6:.1f} MB -> {head_path.stat().st_size / 1e6:.2f} MB")
+        update_log(args.log, str(archive), str(head_path))
+        converted += 1
+
+        if args.delete:
+            archive.unlink()
+
+    print(f"✅ Converted {converted} archives" + (f", {failed} failed" if failed else ""))
+
+if __name__ == "__main__":
+    main()
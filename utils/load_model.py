@@ -1,6 +1,8 @@
 """Model loading utilities for the product recommendation system."""
 import os
+import hashlib
 from pathlib import Path
+import numpy as np
 import streamlit as st  # type: ignore
 import tensorflow as tf
 import tensorflow.keras as keras # pylint: disable=import-error,no-name-in-module
@@ -10,6 +12,9 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 tf.config.set_visible_devices([], 'GPU')
 
 MODELS = Path("models/original_models")
+RETRAINED_MODELS = Path("models/retrained_models")
+HEAD_CHECKPOINT_SUFFIX = ".head.npz"
+_backbone_hashes = {}
 
 @st.cache_resource
 def recreate_model_architecture(): # type: ignore
@@ -62,3 +67,127 @@ def load_face_model():
     except FileNotFoundError as e:
         st.error(f"Failed to load skin cancer model: {e}")
         return None
+
+def build_embedding_model(model):
+    """
+    Wrap the classifier so one forward pass returns both the pooled
+    EfficientNet embedding and the class probabilities
+
+    Args:
+        model: Classifier returned by recreate_model_architecture
+
+    Returns:
+        keras.Model with outputs [embedding, predictions]
+    """
+    inputs = keras.Input(shape=model.layers[0].inputs[0].shape[1:])
+    x = inputs
+    embedding = None
+    for layer in model.layers:
+        x = layer(x)
+        if isinstance(layer, keras.layers.GlobalAveragePooling2D):
+            embedding = x
+
+    return keras.Model(inputs=inputs, outputs=[embedding, x], name='SkinCancerEmbedder')
+
+def build_low_resolution_model(model, size=128, base_model=None):
+    """
+    Build a cheap first-stage classifier that runs the same weights at a
+    lower input resolution
+
+    The backbone is re-instantiated for the smaller input and given a copy of
+    the full model's backbone weights; the pooled head layers are shared, so
+    head weight updates on the full model apply here too.
+
+    Args:
+        model: Classifier returned by recreate_model_architecture
+        size: Input resolution for the first stage
+        base_model: Existing low-resolution backbone to reuse, e.g. when
+            pairing it with a different head
+
+    Returns:
+        keras.Sequential accepting (size, size, 3) inputs
+    """
+    if base_model is None:
+        base_model = keras.applications.EfficientNetB0(
+            include_top=False,
+            weights=None,
+            input_shape=(size, size, 3)
+        )
+        base_model.set_weights(model.layers[0].get_weights())
+        base_model.trainable = False
+
+    return keras.Sequential(
+        [base_model] + model.layers[1:],
+        name=f'SkinCancerClassifier_{size}px'
+    )
+
+def backbone_hash(model, refresh=False):
+    """
+    SHA-256 of the frozen backbone weights a head checkpoint depends on
+
+    The hash is cached per backbone object so version switches do not rehash
+    the backbone; pass refresh=True after loading new backbone weights.
+    """
+    base_model = model.layers[0]
+    if refresh or id(base_model) not in _backbone_hashes:
+        digest = hashlib.sha256()
+        for weight in base_model.get_weights():
+            digest.update(np.ascontiguousarray(weight).tobytes())
+        _backbone_hashes[id(base_model)] = digest.hexdigest()
+    return _backbone_hashes[id(base_model)]
+
+def save_head_checkpoint(model, path):
+    """
+    Save only the trainable head (BatchNorm/Dense layers) of the classifier
+
+    Args:
+        model: Classifier returned by recreate_model_architecture
+        path: Destination ending in .head.npz
+
+    Returns:
+        Backbone hash stored in the checkpoint
+    """
+    arrays = {}
+    for index, layer in enumerate(model.layers[1:], start=1):
+        for i, weight in enumerate(layer.get_weights()):
+            arrays[f'layer_{index}_{i}'] = weight
+
+    digest = backbone_hash(model, refresh=True)
+    np.savez(path, backbone_sha256=np.array(digest), **arrays)
+    return digest
+
+def load_head_checkpoint(model, path):
+    """
+    Load head weights into a model whose backbone is already loaded
+
+    Raises:
+        ValueError: If the checkpoint was trained against a different backbone
+    """
+    with np.load(path) as checkpoint:
+        expected = str(checkpoint['backbone_sha256'])
+        if expected != backbone_hash(model):
+            raise ValueError(
+                f"{path} expects backbone {expected[:12]}, loaded backbone is {backbone_hash(model)[:12]}"
+            )
+
+        for index, layer in enumerate(model.layers[1:], start=1):
+            n_weights = len(layer.weights)
+            if n_weights:
+                layer.set_weights([checkpoint[f'layer_{index}_{i}'] for i in range(n_weights)])
+
+def clone_with_head_checkpoint(model, path):
+    """
+    Build a classifier that shares model's backbone but has its own head
+    loaded from a head-only checkpoint
+
+    model itself is left untouched, so predictions running on it keep the
+    old head until the caller swaps references to the returned model.
+
+    Raises:
+        ValueError: If the checkpoint was trained against a different backbone
+    """
+    head = [layer.__class__.from_config(layer.get_config()) for layer in model.layers[1:]]
+    new_model = keras.Sequential([model.layers[0]] + head, name=model.name)
+    new_model.build(model.layers[0].inputs[0].shape)
+    load_head_checkpoint(new_model, path)
+    return new_model
@@ -0,0 +1,138 @@
+"""Zero-copy parsing of pre-sized uint8 RGB tensors sent by edge clients"""
+import io
+import os
+import numpy as np
+from fastapi import HTTPException
+
+IMG_SIZE = 224
+MAX_TENSOR_BATCH = int(os.environ.get('API_MAX_TENSOR_BATCH', '32'))
+RAW_CONTENT_TYPES = ('application/octet-stream',)
+NPY_CONTENT_TYPES = ('application/x-npy', 'application/npy')
+NPY_MAGIC = b'\x93NUMPY'
+NPY_HEADER_MAX_BYTES = 4096
+MAX_TENSOR_BYTES = MAX_TENSOR_BATCH * IMG_SIZE * IMG_SIZE * 3
+
+def _validate_shape(shape):
+    """Check a tensor shape and return it as a batch shape (n, 224, 224, 3)"""
+    shape = tuple(shape)
+    if len(shape) == 3:
+        shape = (1,) + shape
+
+    if len(shape) != 4 or shape[1:] != (IMG_SIZE, IMG_SIZE, 3):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Expected shape ({IMG_SIZE}, {IMG_SIZE}, 3) or (n, {IMG_SIZE}, {IMG_SIZE}, 3), got {shape}"
+        )
+    if not 1 <= shape[0] <= MAX_TENSOR_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch size must be between 1 and {MAX_TENSOR_BATCH}, got {shape[0]}"
+        )
+    return shape
+
+def parse_shape_header(value):
+    """Parse an X-Tensor-Shape header such as '224,224,3' or '8,224,224,3'"""
+    if not value:
+        raise HTTPException(status_code=400, detail="Missing X-Tensor-Shape header")
+    try:
+        return tuple(int(dim) for dim in value.replace('x', ',').split(','))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid X-Tensor-Shape header: {value}")
+
+def _read_npy_header(body):
+    """Return (shape, dtype, data offset) from an in-memory .npy payload"""
+    fp = io.BytesIO(body)
+    try:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid .npy payload: {e}")
+
+    if fortran_order:
+        raise HTTPException(status_code=400, detail="Fortran-ordered arrays are not supported")
+    return shape, dtype, fp.tell()
+
+def check_tensor_request(content_type, content_length, shape_header=None):
+    """
+    Validate a tensor request from its headers, before the body is read
+
+    Raw payloads must declare a valid X-Tensor-Shape whose size matches
+    Content-Length; .npy payloads are only bounded by the largest allowed
+    batch since their shape lives in the body.
+
+    Args:
+        content_type: Request Content-Type
+        content_length: Request Content-Length header, if any
+        shape_header: Value of X-Tensor-Shape (raw payloads only)
+
+    Returns:
+        'raw', 'npy', or None when no content type was given
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in NPY_CONTENT_TYPES:
+        payload_format = 'npy'
+    elif content_type in RAW_CONTENT_TYPES:
+        payload_format = 'raw'
+    elif not content_type:
+        payload_format = None
+    else:
+        raise HTTPException(
+            status_code=415,
+            detail="Expected application/octet-stream with X-Tensor-Shape, or application/x-npy"
+        )
+
+    length = int(content_length) if content_length and content_length.isdigit() else None
+
+    if payload_format == 'raw':
+        shape = _validate_shape(parse_shape_header(shape_header))
+        expected = int(np.prod(shape))
+        if length is not None and length != expected:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Content-Length is {length} bytes, shape {shape} needs {expected}"
+            )
+    elif length is not None and length > MAX_TENSOR_BYTES + NPY_HEADER_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Tensor payload exceeds {MAX_TENSOR_BATCH} images"
+        )
+
+    return payload_format
+
+def tensor_from_body(body, payload_format, shape_header=None):
+    """
+    Wrap a request body as a (n, 224, 224, 3) uint8 array without copying
+
+    The returned array is a read-only view over the request bytes.
+
+    Args:
+        body: Raw request body
+        payload_format: Result of check_tensor_request; when None the
+            format is sniffed from the .npy magic bytes
+        shape_header: Value of X-Tensor-Shape (raw payloads only)
+
+    Returns:
+        numpy array of shape (n, 224, 224, 3) and dtype uint8
+    """
+    if payload_format is None:
+        payload_format = 'npy' if body.startswith(NPY_MAGIC) else 'raw'
+
+    if payload_format == 'npy':
+        shape, dtype, offset = _read_npy_header(body)
+        if dtype != np.uint8:
+            raise HTTPException(status_code=400, detail=f"Expected dtype uint8, got {dtype}")
+    else:
+        shape, offset = parse_shape_header(shape_header), 0
+
+    shape = _validate_shape(shape)
+    expected = int(np.prod(shape))
+    if len(body) - offset != expected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Payload has {len(body) - offset} bytes, shape {shape} needs {expected}"
+        )
+
+    return np.frombuffer(body, dtype=np.uint8, count=expected, offset=offset).reshape(shape)
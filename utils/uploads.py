@@ -0,0 +1,173 @@
+"""Streaming upload limits, header sniffing and memory accounting for image endpoints"""
+import os
+import threading
+from contextlib import contextmanager
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse # import-error
+from PIL import Image
+from starlette.formparsers import MultiPartParser
+
+MAX_UPLOAD_BYTES = int(os.environ.get('API_MAX_UPLOAD_MB', '10')) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get('API_MAX_IMAGE_PIXELS', '40000000'))
+# Starlette already spools upload parts larger than this to a temporary file on disk
+SPOOL_MAX_BYTES = MultiPartParser.spool_max_size
+# JPEGs are only draft-decoded when much larger than the model input
+DRAFT_MIN_SIDE_FACTOR = 4
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'JPEG',
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+}
+
+class UploadMetrics:
+    """Thread-safe counters for in-flight upload memory and early rejections"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.peak_in_flight_bytes = 0
+        self.max_request_bytes = 0
+        self.rejected = {"413": 0, "415": 0}
+
+    def reject(self, status_code):
+        """Count an early rejection"""
+        with self._lock:
+            self.rejected[str(status_code)] += 1
+
+    @contextmanager
+    def track(self, request_bytes):
+        """Account for one request holding request_bytes while inside the block"""
+        with self._lock:
+            self.in_flight += 1
+            self.in_flight_bytes += request_bytes
+            self.peak_in_flight_bytes = max(self.peak_in_flight_bytes, self.in_flight_bytes)
+            self.max_request_bytes = max(self.max_request_bytes, request_bytes)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.in_flight_bytes -= request_bytes
+
+    def summary(self):
+        """Return current and peak memory figures"""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "in_flight_bytes": self.in_flight_bytes,
+                "peak_in_flight_bytes": self.peak_in_flight_bytes,
+                "max_request_bytes": self.max_request_bytes,
+                "request_bytes_bound": max_request_memory(),
+                "rejected": dict(self.rejected),
+            }
+
+upload_metrics = UploadMetrics()
+
+def _reject(status_code, detail):
+    """Count and raise an early rejection"""
+    upload_metrics.reject(status_code)
+    raise HTTPException(status_code=status_code, detail=detail)
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware enforcing a request body limit while the body streams in
+
+    Requests declaring a larger Content-Length are answered with 413 before
+    any body is read; chunked or mis-declared bodies are cut off as soon as
+    the running total passes the limit.
+    """
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length is not None and content_length.isdigit() \
+                and int(content_length) > self.max_bytes:
+            upload_metrics.reject(413)
+            response = JSONResponse(
+                {"detail": f"Upload exceeds {self.max_bytes} bytes"}, status_code=413
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    _reject(413, f"Upload exceeds {self.max_bytes} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def open_upload_image(upload, target_size=224):
+    """
+    Validate an uploaded image from its header and open it lazily
+
+    Only the header is read here: format is sniffed from the magic bytes and
+    dimensions from the image header, so bogus or oversized images are
+    rejected before any pixel data is decoded. JPEGs much larger than
+    target_size (e.g. phone photos) are set to decode at reduced scale;
+    dataset-sized images decode in full, matching load_image_array.
+
+    Args:
+        upload: FastAPI UploadFile (backed by a spooled temporary file)
+        target_size: Final model input size
+
+    Returns:
+        PIL Image, not yet decoded
+    """
+    fileobj = upload.file
+    fileobj.seek(0)
+    header = fileobj.read(16)
+    fileobj.seek(0)
+
+    if not any(header.startswith(signature) for signature in IMAGE_SIGNATURES):
+        _reject(415, "Unsupported image format, expected JPEG or PNG")
+
+    try:
+        image = Image.open(fileobj, formats=list(IMAGE_SIGNATURES.values()))
+    except Image.DecompressionBombError as e:
+        _reject(413, str(e))
+    except Exception:  # pylint: disable=broad-except
+        _reject(415, "Could not read image header")
+
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        _reject(413, f"Image of {width}x{height} exceeds {MAX_IMAGE_PIXELS} pixels")
+
+    if image.format == 'JPEG' and min(width, height) >= DRAFT_MIN_SIDE_FACTOR * target_size:
+        image.draft('RGB', (target_size, target_size))
+
+    return image
+
+def _model_input_bytes(target_size):
+    """Resized uint8 array plus its float32 model input"""
+    return target_size * target_size * 3 * (1 + 4)
+
+def estimate_request_memory(upload, image, target_size=224):
+    """
+    Estimate bytes held in memory while serving one upload
+
+    PIL stores decoded pixels in at most 4 bytes each; non-RGB images
+    (RGBA, LA, P, ...) also keep a converted RGB copy alive alongside the
+    decoded image.
+    """
+    body_bytes = min(upload.size or 0, SPOOL_MAX_BYTES)
+    width, height = image.size
+    copies = 1 if image.mode == 'RGB' else 2
+    decoded_bytes = width * height * 4 * copies
+    return body_bytes + decoded_bytes + _model_input_bytes(target_size)
+
+def max_request_memory(target_size=224):
+    """Upper bound on bytes held in memory by one upload (decoded image plus RGB copy)"""
+    return SPOOL_MAX_BYTES + MAX_IMAGE_PIXELS * 4 * 2 + _model_input_bytes(target_size)